@@ -5,116 +5,393 @@ A super simple FastAPI application that allows students to view and sign up
 for extracurricular activities at Mergington High School.
 """
 
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, EmailStr
+from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+import aiosqlite
+import asyncio
+import gzip
+import hashlib
+import orjson
 import os
+import sys
+import time
 from pathlib import Path
+from types import MappingProxyType
+
+# SQLite file the participants are persisted to
+DB_PATH = os.environ.get("ACTIVITIES_DB", "activities.db")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the database, load saved signups and warm the /activities cache"""
+    global _data_version
+    # One connection for the app's lifetime, shared by every request
+    async with aiosqlite.connect(DB_PATH) as db:
+        # WAL lets signups commit without blocking concurrent readers
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute(
+            "CREATE TABLE IF NOT EXISTS participants ("
+            "activity TEXT NOT NULL, email TEXT NOT NULL, "
+            "PRIMARY KEY (activity, email))"
+        )
+        await db.commit()
+        _data_version = None
+        await _sync_participants(db)
+        # Warm the cache so the first /activities request is served from it
+        _rebuild_cache()
+        app.state.db = db
+        # Guards the shared connection and the in-memory participants: a reload
+        # and a signup/unregister (check, write, commit, update memory) never
+        # interleave, and a commit never includes another request's statement
+        app.state.db_lock = asyncio.Lock()
+        yield
+
 
 app = FastAPI(title="Mergington High School API",
-              description="API for viewing and signing up for extracurricular activities")
+              description="API for viewing and signing up for extracurricular activities",
+              default_response_class=ORJSONResponse,
+              lifespan=lifespan)
+
+# Per-client rate limit on the write endpoints. The default in-process storage
+# counts per worker; point RATELIMIT_STORAGE_URI at a shared store (e.g.
+# redis://host:6379) to enforce one limit across workers
+limiter = Limiter(key_func=get_remote_address,
+                  storage_uri=os.environ.get("RATELIMIT_STORAGE_URI", "memory://"))
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honoring q=0"""
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, *params = coding.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[name.strip().lower()] = q
+    # An explicit gzip entry wins over the "*" wildcard
+    q = qualities.get("gzip", qualities.get("*", 0.0))
+    return q > 0
+
+
+class StrictGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that skips clients refusing gzip with q=0"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not _accepts_gzip(
+                Headers(scope=scope).get("accept-encoding", "")):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Compress larger responses such as the /activities payload
+app.add_middleware(StrictGZipMiddleware, minimum_size=500)
 
-# Mount the static files directory
 current_dir = Path(__file__).parent
-app.mount("/static", StaticFiles(directory=os.path.join(Path(__file__).parent,
-          "static")), name="static")
-
-# In-memory activity database
-activities = {
-    "Basketball": {
-        "description": "Learn basketball skills and join our competitive team",
-        "schedule": "Monday & Wednesday, 3:30 PM",
-        "participants": []
-    },
-    "Soccer": {
-        "description": "Play soccer and develop teamwork skills",
-        "schedule": "Tuesday & Thursday, 3:30 PM",
-        "participants": []
-    },
-    "Tennis": {
-        "description": "Master tennis techniques and compete in tournaments",
-        "schedule": "Monday & Friday, 4:00 PM",
-        "participants": []
-    },
-    "Volleyball": {
-        "description": "Join our volleyball team and improve your athletic abilities",
-        "schedule": "Wednesday & Saturday, 3:00 PM",
-        "participants": []
-    },
-    "Painting": {
-        "description": "Explore painting techniques and create beautiful artworks",
-        "schedule": "Tuesday & Thursday, 4:00 PM",
-        "participants": []
-    },
-    "Theater": {
-        "description": "Perform in school plays and develop acting skills",
-        "schedule": "Monday, Wednesday & Friday, 4:30 PM",
-        "participants": []
-    },
-    "Photography": {
-        "description": "Learn photography and capture the world through your lens",
-        "schedule": "Saturday, 2:00 PM",
-        "participants": []
-    },
-    "Debate Club": {
-        "description": "Develop public speaking and argumentation skills",
-        "schedule": "Tuesday & Thursday, 3:45 PM",
-        "participants": []
-    },
-    "Science Club": {
-        "description": "Conduct experiments and explore scientific concepts",
-        "schedule": "Wednesday, 4:00 PM",
-        "participants": []
-    },
-    "Chess Club": {
-        "description": "Master chess strategy and compete with other players",
-        "schedule": "Saturday, 1:00 PM",
-        "participants": []
-    }
+
+
+class CachedStaticFiles(StaticFiles):
+    """Static files that browsers cache but revalidate on every use"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        # None of the assets are fingerprinted, so a long max-age would keep an
+        # old app.js talking to a changed API after a deploy; revalidating with
+        # ETag / Last-Modified costs only a 304
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+# In-memory activity database, stored column-wise: one tuple per field
+_NAMES = (
+    "Basketball",
+    "Soccer",
+    "Tennis",
+    "Volleyball",
+    "Painting",
+    "Theater",
+    "Photography",
+    "Debate Club",
+    "Science Club",
+    "Chess Club",
+)
+_DESCS = (
+    "Learn basketball skills and join our competitive team",
+    "Play soccer and develop teamwork skills",
+    "Master tennis techniques and compete in tournaments",
+    "Join our volleyball team and improve your athletic abilities",
+    "Explore painting techniques and create beautiful artworks",
+    "Perform in school plays and develop acting skills",
+    "Learn photography and capture the world through your lens",
+    "Develop public speaking and argumentation skills",
+    "Conduct experiments and explore scientific concepts",
+    "Master chess strategy and compete with other players",
+)
+_SCHEDS = (
+    "Monday & Wednesday, 3:30 PM",
+    "Tuesday & Thursday, 3:30 PM",
+    "Monday & Friday, 4:00 PM",
+    "Wednesday & Saturday, 3:00 PM",
+    "Tuesday & Thursday, 4:00 PM",
+    "Monday, Wednesday & Friday, 4:30 PM",
+    "Saturday, 2:00 PM",
+    "Tuesday & Thursday, 3:45 PM",
+    "Wednesday, 4:00 PM",
+    "Saturday, 1:00 PM",
+)
+
+# Read-only activity metadata; description and schedule never change
+_META = MappingProxyType({
+    name: MappingProxyType({"description": desc, "schedule": sched})
+    for name, desc, sched in zip(_NAMES, _DESCS, _SCHEDS)
+})
+
+# The only mutable state: emails of the students signed up for each activity
+_PARTICIPANTS: dict[str, set[str]] = {name: set() for name in _META}
+
+# Metadata serialized once as the start of each activity's JSON entry, up to
+# the participants value, e.g. '"Soccer":{"description":...,"participants":'
+_META_JSON = {
+    name: orjson.dumps(name) + b":" + orjson.dumps(dict(meta))[:-1] + b',"participants":'
+    for name, meta in _META.items()
 }
 
 
-@app.get("/")
-def root():
-    return RedirectResponse(url="/static/index.html")
+class SignupRequest(BaseModel):
+    """Request body for signing up a student"""
+    email: EmailStr
+
+
+# Reverse index of email -> names of the activities that student is signed up
+# for; students with no signups have no entry
+_email_index: dict[str, set[str]] = {}
+
+# Fixed errors as (status code, pre-serialized body); the body is encoded once
+# and each request gets its own Response via _error()
+_ERR_NOT_FOUND = (404, orjson.dumps({"detail": "Activity not found"}))
+_ERR_DUPLICATE = (400, orjson.dumps({"detail": "Student already signed up for this activity"}))
+_ERR_NOT_SIGNED_UP = (400, orjson.dumps({"detail": "Student not signed up for this activity"}))
+
+
+def _error(err: tuple[int, bytes]) -> Response:
+    """Build a fresh JSON error response from a precomputed error"""
+    status_code, body = err
+    return Response(body, status_code=status_code, media_type="application/json")
+
+
+# Serialized /activities payload and its gzipped copy, rebuilt lazily after
+# any mutation
+_cache_raw: bytes | None = None
+_cache_gz: bytes | None = None
+
+# ETag derived from the cached payload, so it is the same across restarts and
+# worker processes whenever the content is
+_etag: str = ""
+
+
+def _rebuild_cache() -> None:
+    """Serialize and gzip the activities once and keep both until invalidated"""
+    global _cache_raw, _cache_gz, _etag
+    # Only the participants are encoded here; sets become sorted lists
+    raw = b"{" + b",".join(
+        prefix + orjson.dumps(sorted(_PARTICIPANTS[name])) + b"}"
+        for name, prefix in _META_JSON.items()
+    ) + b"}"
+    _cache_gz = gzip.compress(raw, compresslevel=6)
+    _etag = f'W/"{hashlib.blake2b(raw, digest_size=8).hexdigest()}"'
+    _cache_raw = raw
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header matches etag, using weak comparison"""
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+# PRAGMA data_version as of the last reload on this process's connection;
+# SQLite changes it whenever another connection, such as another worker's,
+# commits
+_data_version: int | None = None
+
+# GET /activities checks for other workers' changes at most this often, so
+# most reads skip the database entirely; writes always check
+SYNC_INTERVAL = 1.0
+_last_sync: float = 0.0
+
+
+async def _write(db: aiosqlite.Connection, sql: str, params: tuple) -> int:
+    """Run one write statement and commit it, returning the affected row count
+
+    The caller must hold app.state.db_lock.
+    """
+    try:
+        cursor = await db.execute(sql, params)
+        await db.commit()
+    except BaseException:
+        # Leave the shared connection outside any transaction
+        await db.rollback()
+        raise
+    return cursor.rowcount
+
+
+async def _read_participants(
+        db: aiosqlite.Connection) -> tuple[dict[str, set[str]], dict[str, set[str]]]:
+    """Read the saved rows as participants per activity and an email index"""
+    loaded: dict[str, set[str]] = {name: set() for name in _PARTICIPANTS}
+    index: dict[str, set[str]] = {}
+    async with db.execute("SELECT activity, email FROM participants") as cursor:
+        async for activity_name, email in cursor:
+            if activity_name not in loaded:
+                continue
+            email = sys.intern(email)
+            loaded[activity_name].add(email)
+            index.setdefault(email, set()).add(activity_name)
+    return loaded, index
+
+
+async def _load_participants(db: aiosqlite.Connection) -> None:
+    """Replace the in-memory participants and email index with the saved rows"""
+    global _cache_raw
+    loaded, index = await _read_participants(db)
+
+    # Swap in the new state without awaiting, so no request sees it half-done
+    for name, participants in _PARTICIPANTS.items():
+        participants.clear()
+        participants.update(loaded[name])
+    _email_index.clear()
+    _email_index.update(index)
+    _cache_raw = None
+
+
+async def _sync_participants(db: aiosqlite.Connection) -> None:
+    """Reload participants if another process has committed since the last load
+
+    The caller must hold app.state.db_lock.
+    """
+    global _data_version, _last_sync
+    async with db.execute("PRAGMA data_version") as cursor:
+        (version,) = await cursor.fetchone()
+    if version != _data_version:
+        await _load_participants(db)
+        # Only recorded once the reload is in place
+        _data_version = version
+    _last_sync = time.monotonic()
 
 
 @app.get("/activities")
-def get_activities():
-    return activities
+async def get_activities(request: Request):
+    # Pick up signups made by other worker processes
+    if time.monotonic() - _last_sync >= SYNC_INTERVAL:
+        async with request.app.state.db_lock:
+            await _sync_participants(request.app.state.db)
+    if _cache_raw is None:
+        _rebuild_cache()
+    headers = {"ETag": _etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(request.headers.get("if-none-match", ""), _etag):
+        return Response(status_code=304, headers=headers)
+
+    # Serve the pre-compressed copy; GZipMiddleware skips encoded responses
+    if _accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        return Response(_cache_gz, media_type="application/json", headers=headers)
+    return Response(_cache_raw, media_type="application/json", headers=headers)
 
 
 @app.post("/activities/{activity_name}/signup")
-def signup_for_activity(activity_name: str, email: str):
+@limiter.limit("10/minute")
+async def signup_for_activity(request: Request, activity_name: str, body: SignupRequest):
     """Sign up a student for an activity"""
-    # Validate activity exists
-    if activity_name not in activities:
-        raise HTTPException(status_code=404, detail="Activity not found")
-
-    # Get the specific activity
-    activity = activities[activity_name]
-   
-    # Validate student is not already signed up
-    if email in activity["participants"]:
-        raise HTTPException(status_code=400, detail="Student already signed up for this activity")
-    
-    # Add student
-    activity["participants"].append(email)
+    global _cache_raw
+    # Share one string object per student across all activities
+    email = sys.intern(body.email)
+
+    # Get the specific activity's participants, validating it exists
+    participants = _PARTICIPANTS.get(activity_name)
+    if participants is None:
+        return _error(_ERR_NOT_FOUND)
+
+    async with request.app.state.db_lock:
+        db = request.app.state.db
+        await _sync_participants(db)
+
+        # Validate student is not already signed up
+        if email in participants:
+            return _error(_ERR_DUPLICATE)
+
+        # Add student, persisting before the in-memory state changes
+        inserted = await _write(
+            db, "INSERT OR IGNORE INTO participants (activity, email) VALUES (?, ?)",
+            (activity_name, email))
+        participants.add(email)
+        _email_index.setdefault(email, set()).add(activity_name)
+        _cache_raw = None
+
+        # Another worker process already stored this signup
+        if inserted == 0:
+            return _error(_ERR_DUPLICATE)
     return {"message": f"Signed up {email} for {activity_name}"}
 
 
 @app.post("/activities/{activity_name}/unregister")
-def unregister_from_activity(activity_name: str, email: str):
+@limiter.limit("10/minute")
+async def unregister_from_activity(request: Request, activity_name: str,
+                                   email: EmailStr):
     """Unregister a student from an activity"""
-    # Validate activity exists
-    if activity_name not in activities:
-        raise HTTPException(status_code=404, detail="Activity not found")
+    global _cache_raw
+    # Share one string object per student across all activities
+    email = sys.intern(email)
+
+    # Get the specific activity's participants, validating it exists
+    participants = _PARTICIPANTS.get(activity_name)
+    if participants is None:
+        return _error(_ERR_NOT_FOUND)
 
-    activity = activities[activity_name]
+    async with request.app.state.db_lock:
+        db = request.app.state.db
+        await _sync_participants(db)
 
-    # Validate student is signed up
-    if email not in activity["participants"]:
-        raise HTTPException(status_code=400, detail="Student not signed up for this activity")
+        # Validate student is signed up
+        if email not in participants:
+            return _error(_ERR_NOT_SIGNED_UP)
 
-    activity["participants"].remove(email)
+        deleted = await _write(
+            db, "DELETE FROM participants WHERE activity = ? AND email = ?",
+            (activity_name, email))
+        participants.discard(email)
+        signed_up = _email_index.get(email)
+        if signed_up is not None:
+            signed_up.discard(activity_name)
+            if not signed_up:
+                del _email_index[email]
+        _cache_raw = None
+
+        # Another worker process already removed this signup
+        if deleted == 0:
+            return _error(_ERR_NOT_SIGNED_UP)
     return {"message": f"Unregistered {email} from {activity_name}"}
+
+
+# Mount the static files directory at the root, after the API routes so they
+# take precedence; html=True serves index.html for "/"
+app.mount("/", CachedStaticFiles(directory=os.path.join(current_dir, "static"),
+          html=True), name="static")
@@ -2,43 +2,65 @@
 Tests for the Mergington High School Activities API
 """
 
+import asyncio
+
+import aiosqlite
+import httpx
 import pytest
-from fastapi.testclient import TestClient
-from src.app import app, activities
+import pytest_asyncio
+from asgi_lifespan import LifespanManager
+import src.app as app_module
+from src.app import app
+
+
+pytestmark = pytest.mark.asyncio
 
 
-@pytest.fixture
-def client():
-    """Create a test client for the FastAPI app"""
-    return TestClient(app)
+def make_client():
+    """Create an async client that talks to the app over ASGI"""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                             base_url="http://testserver")
+
+
+@pytest_asyncio.fixture
+async def client(tmp_path, monkeypatch):
+    """Create a test client for the FastAPI app backed by a fresh database"""
+    monkeypatch.setattr(app_module, "DB_PATH", str(tmp_path / "activities.db"))
+    async with LifespanManager(app), make_client() as client:
+        yield client
 
 
 @pytest.fixture(autouse=True)
 def reset_activities():
     """Reset activities to clean state before each test"""
     # Clear participants from all activities
-    for activity in activities.values():
-        activity["participants"] = []
+    for participants in app_module._PARTICIPANTS.values():
+        participants.clear()
+    app_module._cache_raw = None
+    app_module._email_index.clear()
+    app_module.limiter.reset()
     yield
     # Clean up after test
-    for activity in activities.values():
-        activity["participants"] = []
+    for participants in app_module._PARTICIPANTS.values():
+        participants.clear()
+    app_module._cache_raw = None
+    app_module._email_index.clear()
 
 
 class TestGetActivities:
     """Tests for GET /activities endpoint"""
 
-    def test_get_activities_returns_dict(self, client):
+    async def test_get_activities_returns_dict(self, client):
         """Test that GET /activities returns a dictionary of activities"""
-        response = client.get("/activities")
+        response = await client.get("/activities")
         assert response.status_code == 200
         data = response.json()
         assert isinstance(data, dict)
         assert len(data) > 0
 
-    def test_get_activities_has_required_fields(self, client):
+    async def test_get_activities_has_required_fields(self, client):
         """Test that each activity has required fields"""
-        response = client.get("/activities")
+        response = await client.get("/activities")
         data = response.json()
         
         for activity_name, activity_data in data.items():
@@ -47,23 +69,91 @@ class TestGetActivities:
             assert "participants" in activity_data
             assert isinstance(activity_data["participants"], list)
 
-    def test_get_activities_contains_expected_activities(self, client):
+    async def test_get_activities_contains_expected_activities(self, client):
         """Test that expected activities are in the response"""
-        response = client.get("/activities")
+        response = await client.get("/activities")
         data = response.json()
         
         expected_activities = ["Basketball", "Soccer", "Tennis", "Volleyball", "Painting"]
         for activity in expected_activities:
             assert activity in data
 
+    async def test_get_activities_is_compressed(self, client):
+        """Test that GET /activities is gzipped when the client accepts it"""
+        response = await client.get("/activities", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert "Basketball" in response.json()
+
+    async def test_get_activities_uncompressed(self, client):
+        """Test that GET /activities is plain JSON when gzip is not accepted"""
+        response = await client.get("/activities", headers={"Accept-Encoding": "identity"})
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+        assert "Basketball" in response.json()
+
+    async def test_get_activities_gzip_refused(self, client):
+        """Test that gzip is not sent when the client gives it q=0"""
+        response = await client.get(
+            "/activities", headers={"Accept-Encoding": "gzip;q=0, identity"}
+        )
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+        assert "Basketball" in response.json()
+
+    async def test_get_activities_not_modified(self, client):
+        """Test that a matching If-None-Match returns 304"""
+        etag = (await client.get("/activities")).headers["etag"]
+        response = await client.get("/activities", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["cache-control"] == "no-cache"
+        assert response.headers["vary"] == "Accept-Encoding"
+
+    async def test_get_activities_not_modified_list_and_wildcard(self, client):
+        """Test that If-None-Match lists and * are honored"""
+        etag = (await client.get("/activities")).headers["etag"]
+        response = await client.get(
+            "/activities", headers={"If-None-Match": f'"other", {etag}'}
+        )
+        assert response.status_code == 304
+        response = await client.get("/activities", headers={"If-None-Match": "*"})
+        assert response.status_code == 304
+
+    async def test_get_activities_etag_tracks_content_across_restart(self, client):
+        """Test that the ETag reflects content, not a per-process counter"""
+        etag = (await client.get("/activities")).headers["etag"]
+        await client.post(
+            "/activities/Chess Club/signup", json={"email": "student@mergington.edu"}
+        )
+
+        # Restart: the saved signup is reloaded, so the old ETag must not match
+        for participants in app_module._PARTICIPANTS.values():
+            participants.clear()
+        app_module._email_index.clear()
+        async with LifespanManager(app), make_client() as restarted:
+            response = await restarted.get("/activities", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+    async def test_get_activities_etag_changes_on_signup(self, client):
+        """Test that signing up invalidates the previous ETag"""
+        etag = (await client.get("/activities")).headers["etag"]
+        await client.post(
+            "/activities/Basketball/signup", json={"email": "student@mergington.edu"}
+        )
+        response = await client.get("/activities", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
 
 class TestSignup:
     """Tests for POST /activities/{activity_name}/signup endpoint"""
 
-    def test_signup_successful(self, client):
+    async def test_signup_successful(self, client):
         """Test successful signup for an activity"""
-        response = client.post(
-            "/activities/Basketball/signup?email=student@mergington.edu"
+        response = await client.post(
+            "/activities/Basketball/signup", json={"email": "student@mergington.edu"}
         )
         assert response.status_code == 200
         data = response.json()
@@ -71,51 +161,73 @@ class TestSignup:
         assert "student@mergington.edu" in data["message"]
         assert "Basketball" in data["message"]
 
-    def test_signup_adds_participant(self, client):
+    async def test_signup_adds_participant(self, client):
         """Test that signup adds participant to activity"""
         email = "test@mergington.edu"
-        client.post(f"/activities/Basketball/signup?email={email}")
+        await client.post("/activities/Basketball/signup", json={"email": email})
         
-        response = client.get("/activities")
+        response = await client.get("/activities")
         activities_data = response.json()
         assert email in activities_data["Basketball"]["participants"]
 
-    def test_signup_duplicate_fails(self, client):
+    async def test_signup_duplicate_fails(self, client):
         """Test that duplicate signup for same activity fails"""
         email = "student@mergington.edu"
         
         # First signup should succeed
-        response1 = client.post(f"/activities/Basketball/signup?email={email}")
+        response1 = await client.post("/activities/Basketball/signup", json={"email": email})
         assert response1.status_code == 200
         
         # Second signup should fail
-        response2 = client.post(f"/activities/Basketball/signup?email={email}")
+        response2 = await client.post("/activities/Basketball/signup", json={"email": email})
         assert response2.status_code == 400
         data = response2.json()
         assert "already signed up" in data["detail"]
 
-    def test_signup_nonexistent_activity_fails(self, client):
+    async def test_signup_nonexistent_activity_fails(self, client):
         """Test that signup for non-existent activity fails"""
-        response = client.post(
-            "/activities/NonExistent/signup?email=student@mergington.edu"
+        response = await client.post(
+            "/activities/NonExistent/signup", json={"email": "student@mergington.edu"}
         )
         assert response.status_code == 404
         data = response.json()
         assert "Activity not found" in data["detail"]
 
-    def test_signup_multiple_students(self, client):
+    async def test_signup_invalid_email_fails(self, client):
+        """Test that a malformed email is rejected before it is stored"""
+        response = await client.post(
+            "/activities/Basketball/signup", json={"email": "not-an-email"}
+        )
+        assert response.status_code == 422
+
+        response = await client.get("/activities")
+        assert response.json()["Basketball"]["participants"] == []
+
+    async def test_signup_concurrent_duplicates(self, client):
+        """Test that concurrent signups with the same email add it only once"""
+        responses = await asyncio.gather(*(
+            client.post("/activities/Basketball/signup",
+                        json={"email": "student@mergington.edu"})
+            for _ in range(5)
+        ))
+        assert sorted(r.status_code for r in responses) == [200, 400, 400, 400, 400]
+
+        response = await client.get("/activities")
+        assert response.json()["Basketball"]["participants"] == ["student@mergington.edu"]
+
+    async def test_signup_multiple_students(self, client):
         """Test that multiple students can sign up for same activity"""
-        response1 = client.post(
-            "/activities/Basketball/signup?email=student1@mergington.edu"
+        response1 = await client.post(
+            "/activities/Basketball/signup", json={"email": "student1@mergington.edu"}
         )
-        response2 = client.post(
-            "/activities/Basketball/signup?email=student2@mergington.edu"
+        response2 = await client.post(
+            "/activities/Basketball/signup", json={"email": "student2@mergington.edu"}
         )
         
         assert response1.status_code == 200
         assert response2.status_code == 200
         
-        response = client.get("/activities")
+        response = await client.get("/activities")
         participants = response.json()["Basketball"]["participants"]
         assert len(participants) == 2
         assert "student1@mergington.edu" in participants
@@ -125,82 +237,325 @@ class TestSignup:
 class TestUnregister:
     """Tests for POST /activities/{activity_name}/unregister endpoint"""
 
-    def test_unregister_successful(self, client):
+    async def test_unregister_successful(self, client):
         """Test successful unregister from an activity"""
         email = "student@mergington.edu"
         
         # First sign up
-        client.post(f"/activities/Basketball/signup?email={email}")
+        await client.post("/activities/Basketball/signup", json={"email": email})
         
         # Then unregister
-        response = client.post(f"/activities/Basketball/unregister?email={email}")
+        response = await client.post(f"/activities/Basketball/unregister?email={email}")
         assert response.status_code == 200
         data = response.json()
         assert "Unregistered" in data["message"]
         assert email in data["message"]
 
-    def test_unregister_removes_participant(self, client):
+    async def test_unregister_removes_participant(self, client):
         """Test that unregister removes participant from activity"""
         email = "student@mergington.edu"
         
         # Sign up
-        client.post(f"/activities/Basketball/signup?email={email}")
+        await client.post("/activities/Basketball/signup", json={"email": email})
         
         # Verify participant is there
-        response = client.get("/activities")
+        response = await client.get("/activities")
         assert email in response.json()["Basketball"]["participants"]
         
         # Unregister
-        client.post(f"/activities/Basketball/unregister?email={email}")
+        await client.post(f"/activities/Basketball/unregister?email={email}")
         
         # Verify participant is gone
-        response = client.get("/activities")
+        response = await client.get("/activities")
         assert email not in response.json()["Basketball"]["participants"]
 
-    def test_unregister_not_signed_up_fails(self, client):
+    async def test_unregister_not_signed_up_fails(self, client):
         """Test that unregistering a non-participant fails"""
-        response = client.post(
+        response = await client.post(
             "/activities/Basketball/unregister?email=notregistered@mergington.edu"
         )
         assert response.status_code == 400
         data = response.json()
         assert "not signed up" in data["detail"]
 
-    def test_unregister_nonexistent_activity_fails(self, client):
+    async def test_unregister_nonexistent_activity_fails(self, client):
         """Test that unregister for non-existent activity fails"""
-        response = client.post(
+        response = await client.post(
             "/activities/NonExistent/unregister?email=student@mergington.edu"
         )
         assert response.status_code == 404
         data = response.json()
         assert "Activity not found" in data["detail"]
 
-    def test_signup_unregister_cycle(self, client):
+    async def test_unregister_normalizes_email(self, client):
+        """Test that unregister matches the normalized email stored by signup"""
+        email = "Bob@Example.COM"
+        await client.post("/activities/Basketball/signup", json={"email": email})
+
+        response = await client.post(
+            "/activities/Basketball/unregister", params={"email": email}
+        )
+        assert response.status_code == 200
+        response = await client.get("/activities")
+        assert response.json()["Basketball"]["participants"] == []
+
+    async def test_unregister_invalid_email_fails(self, client):
+        """Test that a malformed email is rejected by unregister"""
+        response = await client.post(
+            "/activities/Basketball/unregister", params={"email": "not-an-email"}
+        )
+        assert response.status_code == 422
+
+    async def test_signup_unregister_cycle(self, client):
         """Test signup, unregister, and signup again cycle"""
         email = "student@mergington.edu"
         
         # Sign up
-        client.post(f"/activities/Basketball/signup?email={email}")
-        response = client.get("/activities")
+        await client.post("/activities/Basketball/signup", json={"email": email})
+        response = await client.get("/activities")
         assert email in response.json()["Basketball"]["participants"]
         
         # Unregister
-        client.post(f"/activities/Basketball/unregister?email={email}")
-        response = client.get("/activities")
+        await client.post(f"/activities/Basketball/unregister?email={email}")
+        response = await client.get("/activities")
         assert email not in response.json()["Basketball"]["participants"]
         
         # Sign up again (should succeed since we unregistered)
-        response = client.post(f"/activities/Basketball/signup?email={email}")
+        response = await client.post("/activities/Basketball/signup", json={"email": email})
         assert response.status_code == 200
-        response = client.get("/activities")
+        response = await client.get("/activities")
         assert email in response.json()["Basketball"]["participants"]
 
+    async def test_email_index_tracks_signups(self, client):
+        """Test that the email index follows signup and unregister"""
+        email = "student@mergington.edu"
+        await client.post("/activities/Basketball/signup", json={"email": email})
+        await client.post("/activities/Soccer/signup", json={"email": email})
+        assert app_module._email_index[email] == {"Basketball", "Soccer"}
+
+        await client.post(f"/activities/Basketball/unregister?email={email}")
+        assert app_module._email_index[email] == {"Soccer"}
+
+        await client.post(f"/activities/Soccer/unregister?email={email}")
+        assert email not in app_module._email_index
+
+
+class TestActivityData:
+    """Tests for the split between static metadata and participants"""
+
+    async def test_metadata_is_read_only(self):
+        """Test that activity metadata cannot be modified"""
+        with pytest.raises(TypeError):
+            app_module._META["Basketball"]["schedule"] = "Never"
+
+    async def test_cached_payload_matches_data(self, client):
+        """Test that the concatenated payload is the same as encoding the data"""
+        await client.post(
+            "/activities/Chess Club/signup", json={"email": "student@mergington.edu"}
+        )
+        response = await client.get("/activities")
+        assert response.json() == {
+            name: {**meta, "participants": sorted(app_module._PARTICIPANTS[name])}
+            for name, meta in app_module._META.items()
+        }
+
+
+class TestLifespan:
+    """Tests for startup work done in the lifespan handler"""
+
+    async def test_cache_warm_after_startup(self, client):
+        """Test that the /activities cache is populated before any request"""
+        assert app_module._cache_raw is not None
+        assert app_module._cache_gz is not None
+
+
+class TestPersistence:
+    """Tests for persisting participants to SQLite"""
+
+    async def test_participants_survive_restart(self, client):
+        """Test that signups are reloaded from the database on startup"""
+        email = "student@mergington.edu"
+        await client.post("/activities/Basketball/signup", json={"email": email})
+        await client.post("/activities/Soccer/signup", json={"email": email})
+        await client.post("/activities/Soccer/unregister?email=" + email)
+
+        # Simulate a restart: drop in-memory state and run the lifespan again
+        for participants in app_module._PARTICIPANTS.values():
+            participants.clear()
+        app_module._email_index.clear()
+        async with LifespanManager(app), make_client() as restarted:
+            response = await restarted.get("/activities")
+        data = response.json()
+        assert data["Basketball"]["participants"] == [email]
+        assert data["Soccer"]["participants"] == []
+        assert app_module._email_index[email] == {"Basketball"}
+
+    async def test_signup_stored_by_another_worker(self, client):
+        """Test that a signup already in the database is reported as a duplicate"""
+        email = "student@mergington.edu"
+        async with aiosqlite.connect(app_module.DB_PATH) as db:
+            await db.execute("INSERT INTO participants (activity, email) VALUES (?, ?)",
+                             ("Basketball", email))
+            await db.commit()
+
+        response = await client.post("/activities/Basketball/signup", json={"email": email})
+        assert response.status_code == 400
+        response = await client.get("/activities")
+        assert response.json()["Basketball"]["participants"] == [email]
+
+    async def test_unregister_removed_by_another_worker(self, client):
+        """Test that unregistering a row already deleted from the database fails"""
+        email = "student@mergington.edu"
+        await client.post("/activities/Basketball/signup", json={"email": email})
+        async with aiosqlite.connect(app_module.DB_PATH) as db:
+            await db.execute("DELETE FROM participants WHERE email = ?", (email,))
+            await db.commit()
+
+        response = await client.post(
+            "/activities/Basketball/unregister", params={"email": email}
+        )
+        assert response.status_code == 400
+        response = await client.get("/activities")
+        assert response.json()["Basketball"]["participants"] == []
+
+    async def test_failed_write_is_rolled_back(self, client):
+        """Test that a failing write leaves the shared connection usable"""
+        db = app.state.db
+        await db.execute(
+            "CREATE TRIGGER reject_boom BEFORE INSERT ON participants "
+            "WHEN NEW.email = 'boom@mergington.edu' "
+            "BEGIN SELECT RAISE(ABORT, 'rejected'); END"
+        )
+        await db.commit()
+
+        with pytest.raises(Exception, match="rejected"):
+            await client.post(
+                "/activities/Basketball/signup", json={"email": "boom@mergington.edu"}
+            )
+        assert not db.in_transaction
+
+        response = await client.post(
+            "/activities/Basketball/signup", json={"email": "student@mergington.edu"}
+        )
+        assert response.status_code == 200
+
+    async def test_changes_from_another_worker_are_visible(self, client, monkeypatch):
+        """Test that rows written by another process show up in /activities"""
+        monkeypatch.setattr(app_module, "SYNC_INTERVAL", 0)
+        email = "student@mergington.edu"
+        await client.get("/activities")
+        async with aiosqlite.connect(app_module.DB_PATH) as db:
+            await db.execute("INSERT INTO participants (activity, email) VALUES (?, ?)",
+                             ("Chess Club", email))
+            await db.commit()
+
+        response = await client.get("/activities")
+        assert response.json()["Chess Club"]["participants"] == [email]
+
+        async with aiosqlite.connect(app_module.DB_PATH) as db:
+            await db.execute("DELETE FROM participants WHERE email = ?", (email,))
+            await db.commit()
+
+        response = await client.get("/activities")
+        assert response.json()["Chess Club"]["participants"] == []
+        # Signing up again must not be refused by stale in-memory state
+        response = await client.post("/activities/Chess Club/signup", json={"email": email})
+        assert response.status_code == 200
+
+    async def test_reload_does_not_drop_concurrent_signup(self, client, monkeypatch):
+        """Test that a reload racing a signup keeps the new participant"""
+        monkeypatch.setattr(app_module, "SYNC_INTERVAL", 0)
+        read_participants = app_module._read_participants
+
+        async def slow_read(db):
+            # Hold the snapshot so the signup can run between the read and the swap
+            snapshot = await read_participants(db)
+            await asyncio.sleep(0.05)
+            return snapshot
+
+        monkeypatch.setattr(app_module, "_read_participants", slow_read)
+        async with aiosqlite.connect(app_module.DB_PATH) as db:
+            await db.execute("INSERT INTO participants (activity, email) VALUES (?, ?)",
+                             ("Soccer", "other@mergington.edu"))
+            await db.commit()
+
+        async def signup_after_snapshot():
+            await asyncio.sleep(0.01)
+            return await client.post("/activities/Basketball/signup",
+                                     json={"email": "student@mergington.edu"})
+
+        _, signup = await asyncio.gather(client.get("/activities"),
+                                         signup_after_snapshot())
+        assert signup.status_code == 200
+
+        data = (await client.get("/activities")).json()
+        assert data["Basketball"]["participants"] == ["student@mergington.edu"]
+        assert data["Soccer"]["participants"] == ["other@mergington.edu"]
+
+    async def test_reload_in_progress_is_not_skipped(self, client, monkeypatch):
+        """Test that a signup during another request's reload sees fresh data"""
+        monkeypatch.setattr(app_module, "SYNC_INTERVAL", 0)
+        email = "student@mergington.edu"
+        await client.post("/activities/Basketball/signup", json={"email": email})
+        async with aiosqlite.connect(app_module.DB_PATH) as db:
+            await db.execute("DELETE FROM participants WHERE email = ?", (email,))
+            await db.commit()
+
+        _, signup = await asyncio.gather(
+            client.get("/activities"),
+            client.post("/activities/Basketball/signup", json={"email": email}),
+        )
+        assert signup.status_code == 200
+
+    async def test_reads_check_database_at_most_once_per_interval(self, client,
+                                                                  monkeypatch):
+        """Test that GET /activities does not query SQLite on every request"""
+        monkeypatch.setattr(app_module, "SYNC_INTERVAL", 60)
+        await client.get("/activities")
+        async with aiosqlite.connect(app_module.DB_PATH) as db:
+            await db.execute("INSERT INTO participants (activity, email) VALUES (?, ?)",
+                             ("Soccer", "other@mergington.edu"))
+            await db.commit()
+
+        response = await client.get("/activities")
+        assert response.json()["Soccer"]["participants"] == []
+
+
+class TestRateLimit:
+    """Tests for rate limiting on the write endpoints"""
+
+    async def test_signup_rate_limited(self, client):
+        """Test that signups beyond the per-minute limit are rejected"""
+        for i in range(10):
+            response = await client.post(
+                "/activities/Basketball/signup", json={"email": f"s{i}@mergington.edu"}
+            )
+            assert response.status_code == 200
+
+        response = await client.post(
+            "/activities/Basketball/signup", json={"email": "s10@mergington.edu"}
+        )
+        assert response.status_code == 429
+
+
+class TestRoot:
+    """Tests for root endpoint"""
+
+    async def test_root_serves_index(self, client):
+        """Test that root path serves index.html without a redirect"""
+        response = await client.get("/", follow_redirects=False)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/html")
+        assert "app.js" in response.text
 
-class TestRootRedirect:
-    """Tests for root endpoint redirect"""
+    async def test_static_assets_are_revalidated(self, client):
+        """Test that static assets must be revalidated and can return 304"""
+        for path in ("/", "/app.js"):
+            response = await client.get(path)
+            assert response.status_code == 200
+            assert response.headers["cache-control"] == "no-cache"
 
-    def test_root_redirects_to_static(self, client):
-        """Test that root path redirects to static index.html"""
-        response = client.get("/", follow_redirects=False)
-        assert response.status_code == 307
-        assert "/static/index.html" in response.headers["location"]
+            response = await client.get(
+                path, headers={"If-None-Match": response.headers["etag"]}
+            )
+            assert response.status_code == 304